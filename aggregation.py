@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# Each kernel returns, per (group, date): the number of rows, the number of
+# counted rows (weight 1), and the running total of counted rows
+
+def _grouped_counts_numpy(date_codes, group_codes, weights, n_dates, n_groups):
+    flat = group_codes * n_dates + date_codes
+    size = n_groups * n_dates
+    rows = np.bincount(flat, minlength=size).reshape(n_groups, n_dates)
+    counts = np.bincount(flat, weights=weights, minlength=size).astype(np.int64)
+    counts = counts.reshape(n_groups, n_dates)
+    return rows, counts, counts.cumsum(axis=1)
+
+def _grouped_counts_loop(date_codes, group_codes, weights, n_dates, n_groups):
+    rows = np.zeros((n_groups, n_dates), dtype=np.int64)
+    counts = np.zeros((n_groups, n_dates), dtype=np.int64)
+    for i in range(date_codes.shape[0]):
+        rows[group_codes[i], date_codes[i]] += 1
+        counts[group_codes[i], date_codes[i]] += weights[i]
+    totals = np.empty_like(counts)
+    for g in range(n_groups):
+        running = 0
+        for d in range(n_dates):
+            running += counts[g, d]
+            totals[g, d] = running
+    return rows, counts, totals
+
+if njit is not None:
+    grouped_counts = njit(cache=True)(_grouped_counts_loop)
+else:
+    grouped_counts = _grouped_counts_numpy
+
+
+def daily_cumulative_cases(df, keys, population, date_column='DateRepConf'):
+    # Daily and cumulative case counts per group, on the dates each group has rows.
+    # Matches the groupby/reindex/cumsum pipeline this replaces row for row.
+    # `population` is either the name of a population column in `keys` or a number.
+    pop_column = population if isinstance(population, str) else None
+    # Rows without a CaseCode still create a (date, group) row, with zero cases
+    columns = [date_column] + keys
+    complete = df[columns].notna().all(axis=1)
+    counted = df.loc[complete, 'CaseCode'].notna()
+    df = df.loc[complete, columns]
+    if len(df) == 0:
+        return pd.DataFrame(columns=['Date'] + [k for k in keys if k != pop_column]
+            + ['Cases', 'Total', 'Per100k'])
+
+    dates = df[date_column].values.astype('datetime64[D]')
+    start_date = dates.min()
+    n_dates = int((dates.max() - start_date).astype(np.int64)) + 1
+    date_codes = (dates - start_date).astype(np.int64)
+
+    grouped = df.groupby(keys, sort=True)
+    group_codes = grouped.ngroup().values.astype(np.int64)
+    groups = grouped.size().index.to_frame(index=False)
+    n_groups = len(groups)
+
+    weights = counted.values.astype(np.int64)
+    rows, counts, totals = grouped_counts(date_codes, group_codes, weights, n_dates, n_groups)
+
+    # Emit (date, group) pairs with any rows, ordered by date and then by group
+    date_idx, group_idx = np.nonzero(rows.T)
+    cases = counts[group_idx, date_idx]
+    total = totals[group_idx, date_idx]
+    if len(np.unique(date_idx)) < n_dates:
+        # Dates without any rows leave gaps that the pandas pipeline fills with floats
+        cases = cases.astype(np.float64)
+        total = total.astype(np.float64)
+
+    out = {'Date': (start_date + date_idx).astype('datetime64[ns]')}
+    for key in keys:
+        if key != pop_column:
+            out[key] = groups[key].values[group_idx]
+    out['Cases'] = cases
+    out['Total'] = total
+    if pop_column:
+        pop = groups[pop_column].values[group_idx]
+    else:
+        pop = population
+    out['Per100k'] = total / pop * 100000
+    return pd.DataFrame(out).dropna()
@@ -1,4 +1,6 @@
+import os
 from datetime import date, datetime
+from uuid import uuid4
 
 import dash
 import dash_bootstrap_components as dbc
@@ -7,11 +9,18 @@ import dash_html_components as html
 import dash_table
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
+from flask import Response, abort, jsonify, request
 
 import pandas as pd
 
 import plotly.express as px
 
+from aggregation import daily_cumulative_cases
+from export import EXPORT_FORMATS, EXPORT_STREAMS, pa
+from prefetch import Prefetcher, QueryCache
+from rendering import collapse_provinces, downsample_lines
+from summary import SummaryStats
+
 
 def case_aggregates(df):
     aggs = {
@@ -42,6 +51,7 @@ region_names = reg_df.index.tolist()
 prov_df = pd.read_csv('assets/provinces.csv')
 provinces_by_region_dict = prov_df.groupby('reg_internal')['prov_internal'].apply(list).to_dict()
 province_names = dict(zip(prov_df['prov_internal'], prov_df['prov_name']))
+region_by_province = dict(zip(prov_df['prov_internal'], prov_df['reg_internal']))
 
 # Case information cleaning
 cases.drop(
@@ -60,6 +70,8 @@ cases.rename(
 )
 for column in cases[['DateRepConf', 'DateRepRem', 'DateDied', 'DateRecover']]:
     cases[column] = cases[column].dropna().apply(lambda x: datetime.strptime(x, '%Y-%m-%d'))
+# Keep the removal report date for the summary's daily deltas before it is replaced
+cases['DateRepRemReported'] = cases['DateRepRem']
 cases['DateRepRem'] = cases.apply(clean_dates, axis=1)
 cases = cases.assign(Country='PHILIPPINES')
 AGEGROUP_ORDER = [
@@ -72,6 +84,30 @@ AGEGROUP_ORDER = [
 population = pd.read_csv('assets/population.csv')
 cases = cases.merge(population, left_on='Province', right_on='name', how='left')
 NATIONAL_POP = population[population['name'] == 'PHILIPPINES']['pop_2015'].iloc[0]
+province_pops = dict(zip(population['name'], population['pop_2015']))
+
+# Rendering thresholds for line charts with many traces
+# Switch to WebGL above this many traces
+WEBGL_TRACE_THRESHOLD = int(os.environ.get('WEBGL_TRACE_THRESHOLD', 50))
+# Downsample each trace with LTTB when the chart exceeds this many points in total
+LINE_POINT_BUDGET = int(os.environ.get('LINE_POINT_BUDGET', 20000))
+MIN_POINTS_PER_TRACE = int(os.environ.get('MIN_POINTS_PER_TRACE', 30))
+# Collapse all but the top N provinces into an "Other" trace (0 disables). Provinces
+# are also collapsed automatically when there are too many traces for the point budget
+MAX_PROVINCE_TRACES = int(os.environ.get('MAX_PROVINCE_TRACES', 0))
+
+# Query result caching and prefetching
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 32))
+# Most speculative results a worker keeps before they are used
+PREFETCH_LIMIT = int(os.environ.get('PREFETCH_LIMIT', 4))
+# Most sessions with a prefetch waiting for the worker
+PREFETCH_QUEUE_SIZE = int(os.environ.get('PREFETCH_QUEUE_SIZE', 16))
+# Most speculative queries a worker computes per minute; the rest are skipped
+PREFETCH_PER_MINUTE = int(os.environ.get('PREFETCH_PER_MINUTE', 10))
+
+# Rows serialized per chunk of a streamed export
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 5000))
+EXPORT_FILTERS = ['AgeGroup', 'Sex', 'HealthStatus']
 
 # Default data for display
 # Same code as filter_query(), but callback functions can't be called outside the wrapper's scope
@@ -81,22 +117,7 @@ table_df = table_df.groupby('Province').apply(case_aggregates)
 table_df.reset_index(inplace=True)
 df.reset_index()
 
-cases_df = df.groupby(
-    ['DateRepConf', 'Province', 'pop_2015']
-)['CaseCode'].count().reset_index(name='Cases')
-
-dates = cases_df['DateRepConf'].sort_values().values
-start_date = dates[0]
-end_date = dates[-1]
-datelist = pd.DataFrame(pd.date_range(start=start_date, end=end_date, name='Date'))  
-cases_df = datelist.merge(
-    cases_df, left_on='Date', right_on='DateRepConf', how='left')
-
-cases_df['Cases'] = cases_df['Cases'].fillna(0)
-cases_df['Total'] = cases_df.groupby('Province')['Cases'].cumsum()
-cases_df['Per100k'] = cases_df['Total'] / cases_df['pop_2015'] * 100000
-cases_df.drop(columns=['DateRepConf', 'pop_2015'], inplace=True)    
-cases_df = cases_df.dropna()
+cases_df = daily_cumulative_cases(df, ['Province', 'pop_2015'], 'pop_2015')
 
 deaths = df.query("`HealthStatus` == 'Died'")
 totals = df.groupby('Province')['CaseCode'].count().reset_index(name='Cases')
@@ -107,21 +128,29 @@ rates_df['Rate'] = rates_df['Deaths'] / rates_df['Cases']
 default_data = {
     'cases': cases_df.to_dict('records'),
     'deaths': rates_df.to_dict('records'),
-    'aggs': table_df.to_dict('records')
+    'aggs': table_df.to_dict('records'),
+    'columns': {
+        'cases': cases_df.columns.tolist(),
+        'deaths': rates_df.columns.tolist(),
+        'aggs': table_df.columns.tolist()
+    },
+    'dtypes': {
+        'cases': cases_df.dtypes.astype(str).tolist(),
+        'deaths': rates_df.dtypes.astype(str).tolist(),
+        'aggs': table_df.dtypes.astype(str).tolist()
+    }
 }
 
 # Testing aggregates cleaning
 # TODO Clean and display data in aggs dataframe
 
-# Case and testing summary strings
+# Case and testing summary counters
+summary_stats = SummaryStats('DateRepRemReported')
+summary_stats.add_cases(cases)
+summary_stats.add_tests(aggs)
+
 # TODO Format confirmation string to show date of the latest data drop
-CASES = f"{cases['CaseCode'].count():,}" + " cases"
-DEATHS = f"{cases[cases['HealthStatus'] == 'Died']['CaseCode'].count():,}" + " deaths"
-RECOVERIES = f"{cases[cases['HealthStatus'] == 'Recovered']['CaseCode'].count():,}" + " recoveries"
 CONFIRM_TO_DATE = "confirmed by the Department of Health as of Jun 17." # + date.today().strftime("%B %d") + "."
-
-TOTAL_TESTS = (f"{aggs.groupby('facility_name')['cumulative_unique_individuals'].max().sum():,}" +
-    " people tested")
 TEST_TO_DATE = "by 35 DOH certified facilities nationwide."
 
 # Inputs
@@ -195,19 +224,39 @@ search_panel = dbc.Collapse(
 )
 
 # Outputs
-summary_display = dbc.Jumbotron(
-    dbc.Container(
-        [
-            html.H4(", ".join([CASES, DEATHS, RECOVERIES]), className='display-4'),
-            html.P(CONFIRM_TO_DATE, className='lead'),
-            html.Hr(className='my-4'),
-            html.H4(TOTAL_TESTS, className='display-4'),
-            html.P(TEST_TO_DATE, className='lead')
-        ],
+def summary_display(stats):
+    cases_string = ", ".join([
+        f"{stats['cases']:,} cases",
+        f"{stats['deaths']:,} deaths",
+        f"{stats['recoveries']:,} recoveries"
+    ])
+    new_cases_string = ''
+    if stats['cases_date'] is not None:
+        new_cases_string = ", ".join([
+            f"+{stats['new_cases']:,} cases",
+            f"+{stats['new_deaths']:,} deaths",
+            f"+{stats['new_recoveries']:,} recoveries"
+        ]) + f" reported on {stats['cases_date']:%B %d}."
+    tests_string = f"{stats['tests']:,} people tested"
+    new_tests_string = ''
+    if stats['tests_date'] is not None:
+        new_tests_string = (f"+{stats['new_tests']:,} people tested" +
+            f" reported on {stats['tests_date']:%B %d}.")
+    return dbc.Jumbotron(
+        dbc.Container(
+            [
+                html.H4(cases_string, className='display-4'),
+                html.P(CONFIRM_TO_DATE, className='lead'),
+                html.P(new_cases_string),
+                html.Hr(className='my-4'),
+                html.H4(tests_string, className='display-4'),
+                html.P(TEST_TO_DATE, className='lead'),
+                html.P(new_tests_string)
+            ],
+            fluid=True
+        ),
         fluid=True
-    ),
-    fluid=True
-)
+    )
 cases_display = [
     dbc.Row(
         dbc.Col(
@@ -269,7 +318,7 @@ testing_display = dbc.Row(dbc.Col(html.H4('Coming soon!')))
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
 server = app.server
 app.config.suppress_callback_exceptions = True
-app.layout = dbc.Container(
+layout = dbc.Container(
     [
         html.Div(
             [
@@ -358,6 +407,14 @@ app.layout = dbc.Container(
 )
 
 
+def serve_layout():
+    # Served on every page load, so each browser session gets its own id
+    return html.Div([dcc.Store(id='session-store', data=str(uuid4())), layout])
+
+
+app.layout = serve_layout
+
+
 @app.callback(
     Output('about-modal', 'is_open'),
     [Input('about-button', 'n_clicks'), Input('close-about', 'n_clicks')],
@@ -432,27 +489,26 @@ def set_province_options(input_regions, stored_regions, stored_options, stored_p
 
 @app.callback(
     [Output('options-store', 'data'), Output('provinces-store', 'data')],
-    [Input('provinces-dropdown', 'options'), Input('provinces-dropdown', 'value')]
+    [Input('provinces-dropdown', 'options'), Input('provinces-dropdown', 'value')],
+    [State('regions-dropdown', 'value'),
+        State('all-provinces-check', 'value'),
+        State('filters-switch-input', 'value'),
+        State('summed-provinces-check', 'value'),
+        State('session-store', 'data')]
 )
-def store_provinces(options, value):
+def store_provinces(
+    options, value, input_regions, all_checked, filters, summed_check, session):
+    # Speculatively compute the selection before "Select provinces" is clicked
+    if not all_checked and input_regions and value:
+        prefetcher.submit(
+            session, query_key(all_checked, filters, input_regions, value, summed_check))
     return options, value
 
 
-@app.callback(
-    Output('search-store', 'data'),
-    [Input('all-provinces-check', 'value'),
-        Input('select-button', 'n_clicks'),
-        Input('filters-switch-input', 'value'),
-        Input('tabs', 'active_tab')],
-    [State('regions-store', 'data'),
-        State('provinces-store', 'data'),
-        State('summed-provinces-check', 'value')]
-)
-def filter_query(
-    all_checked, n, filters, active_tab,
-    input_regions, input_provinces, summed_check):
-    if active_tab != 'cases':
-        raise PreventUpdate
+def query_data(all_checked, filters, input_regions, input_provinces, summed_check):
+    filters = list(filters)
+    input_regions = list(input_regions)
+    input_provinces = list(input_provinces)
 
     # Filter cases for input provinces and filters
     if not all_checked and input_regions and input_provinces:
@@ -474,31 +530,10 @@ def filter_query(
     # Clean cases data
     filters = [x for x in filters if x != 'HealthStatus']
     if all_checked:
-        cases_df = line_df.groupby(
-            ['DateRepConf', 'Country'] + filters
-        )['CaseCode'].count().reset_index(name='Cases')
+        cases_df = daily_cumulative_cases(line_df, ['Country'] + filters, NATIONAL_POP)
     else:
-        cases_df = line_df.groupby(
-            ['DateRepConf', 'Province', 'pop_2015'] + filters
-        )['CaseCode'].count().reset_index(name='Cases')
-
-    dates = cases_df['DateRepConf'].sort_values().values
-    start_date = dates[0]
-    end_date = dates[-1]
-    datelist = pd.DataFrame(pd.date_range(start=start_date, end=end_date, name='Date'))  
-    cases_df = datelist.merge(
-        cases_df, left_on='Date', right_on='DateRepConf', how='left')
-
-    cases_df['Cases'] = cases_df['Cases'].fillna(0)
-    if all_checked:
-        cases_df['Total'] = cases_df.groupby(['Country'] + filters)['Cases'].cumsum()
-        cases_df['Per100k'] = cases_df['Total'] / NATIONAL_POP * 100000
-        cases_df.drop(columns=['DateRepConf'], inplace=True)   
-    else:
-        cases_df['Total'] = cases_df.groupby(['Province'] + filters)['Cases'].cumsum()
-        cases_df['Per100k'] = cases_df['Total'] / cases_df['pop_2015'] * 100000
-        cases_df.drop(columns=['DateRepConf', 'pop_2015'], inplace=True)    
-    cases_df = cases_df.dropna()
+        cases_df = daily_cumulative_cases(
+            line_df, ['Province', 'pop_2015'] + filters, 'pop_2015')
     
     # Clean deaths data
     deaths = line_df.query("`HealthStatus` == 'Died'")
@@ -523,11 +558,58 @@ def filter_query(
     data = {
         'cases': cases_df.to_dict('records'),
         'deaths': rates_df.to_dict('records'),
-        'aggs': table_df.to_dict('records')
+        'aggs': table_df.to_dict('records'),
+        'columns': {
+            'cases': cases_df.columns.tolist(),
+            'deaths': rates_df.columns.tolist(),
+            'aggs': table_df.columns.tolist()
+        },
+        'dtypes': {
+            'cases': cases_df.dtypes.astype(str).tolist(),
+            'deaths': rates_df.dtypes.astype(str).tolist(),
+            'aggs': table_df.dtypes.astype(str).tolist()
+        }
     }
     return data
 
 
+def query_key(all_checked, filters, input_regions, input_provinces, summed_check):
+    # Selections that query_data() treats the same share a key
+    if all_checked or not (input_regions and input_provinces):
+        input_regions, input_provinces, summed_check = [], [], []
+    return (
+        bool(all_checked),
+        tuple(filters or []),
+        tuple(sorted(input_regions or [])),
+        tuple(sorted(input_provinces or [])),
+        bool(summed_check)
+    )
+
+
+query_cache = QueryCache(query_data, QUERY_CACHE_SIZE, PREFETCH_LIMIT)
+prefetcher = Prefetcher(query_cache, PREFETCH_QUEUE_SIZE, PREFETCH_PER_MINUTE)
+
+
+@app.callback(
+    Output('search-store', 'data'),
+    [Input('all-provinces-check', 'value'),
+        Input('select-button', 'n_clicks'),
+        Input('filters-switch-input', 'value'),
+        Input('tabs', 'active_tab')],
+    [State('regions-store', 'data'),
+        State('provinces-store', 'data'),
+        State('summed-provinces-check', 'value')]
+)
+def filter_query(
+    all_checked, n, filters, active_tab,
+    input_regions, input_provinces, summed_check):
+    if active_tab != 'cases':
+        raise PreventUpdate
+
+    key = query_key(all_checked, filters, input_regions, input_provinces, summed_check)
+    return query_cache.get(key)
+
+
 @app.callback(
     [Output('cases-graph', 'figure'), Output('deaths-graph', 'figure')],
     [Input('search-store', 'data')],
@@ -542,12 +624,33 @@ def on_data_set_figures(data, all_checked, filters, active_tab):
     cases_df = pd.DataFrame.from_dict(data['cases'])
     deaths_df = pd.DataFrame.from_dict(data['deaths'])
 
+    # Adapt line chart rendering to the number of traces and points
+    trace_keys = [c for c in cases_df.columns if c not in ['Date', 'Cases', 'Total', 'Per100k']]
+    line_y = 'Total' if filters else 'Per100k'
+    n_traces = len(cases_df.groupby(trace_keys).size()) if len(cases_df) else 0
+    if not all_checked and n_traces:
+        keep = MAX_PROVINCE_TRACES
+        if n_traces * MIN_POINTS_PER_TRACE > LINE_POINT_BUDGET:
+            # Too many traces to fit the budget even at the minimum points per trace,
+            # so keep only as many provinces as fit, plus the "Other" trace
+            traces_per_province = n_traces / cases_df['Province'].nunique()
+            fit = int(LINE_POINT_BUDGET / (MIN_POINTS_PER_TRACE * traces_per_province)) - 1
+            keep = min(keep, max(fit, 1)) if keep else max(fit, 1)
+        if keep:
+            cases_df = collapse_provinces(cases_df, trace_keys, keep, province_pops)
+            n_traces = len(cases_df.groupby(trace_keys).size())
+    if n_traces and len(cases_df) > LINE_POINT_BUDGET:
+        threshold = max(LINE_POINT_BUDGET // n_traces, MIN_POINTS_PER_TRACE)
+        cases_df = downsample_lines(cases_df, trace_keys, line_y, threshold)
+    render_mode = 'webgl' if n_traces > WEBGL_TRACE_THRESHOLD else 'svg'
+
     if all_checked:
         if 'AgeGroup' in filters and 'Sex' in filters:
             cases_fig = px.line(
                 cases_df,
                 x='Date',
                 y='Total',
+                render_mode=render_mode,
                 color='AgeGroup',
                 facet_col='Sex',
                 hover_data=['Cases', 'Total'],
@@ -573,6 +676,7 @@ def on_data_set_figures(data, all_checked, filters, active_tab):
                 cases_df,
                 x='Date',
                 y='Total',
+                render_mode=render_mode,
                 color='AgeGroup',
                 hover_data=['Cases', 'Total'],
                 category_orders={'AgeGroup': AGEGROUP_ORDER},
@@ -596,6 +700,7 @@ def on_data_set_figures(data, all_checked, filters, active_tab):
                 cases_df,
                 x='Date',
                 y='Total',
+                render_mode=render_mode,
                 color='Sex',
                 hover_data=['Cases', 'Total'],
                 category_orders={'Sex': ['Male', 'Female']},
@@ -619,6 +724,7 @@ def on_data_set_figures(data, all_checked, filters, active_tab):
                 cases_df,
                 x='Date',
                 y='Per100k',
+                render_mode=render_mode,
                 color='Country',
                 hover_data=['Cases', 'Total'],
                 title='COVID-19 case rates nationwide',
@@ -641,6 +747,7 @@ def on_data_set_figures(data, all_checked, filters, active_tab):
                 cases_df,
                 x='Date',
                 y='Total',
+                render_mode=render_mode,
                 line_group='Province',
                 color='AgeGroup',
                 facet_col='Sex',
@@ -667,6 +774,7 @@ def on_data_set_figures(data, all_checked, filters, active_tab):
                 cases_df,
                 x='Date',
                 y='Total',
+                render_mode=render_mode,
                 line_group='Province',
                 color='AgeGroup',
                 hover_data=['Cases', 'Total'],
@@ -691,6 +799,7 @@ def on_data_set_figures(data, all_checked, filters, active_tab):
                 cases_df,
                 x='Date',
                 y='Total',
+                render_mode=render_mode,
                 line_group='Province',
                 color='Sex',
                 hover_data=['Cases', 'Total'],
@@ -716,6 +825,7 @@ def on_data_set_figures(data, all_checked, filters, active_tab):
                 cases_df,
                 x='Date',
                 y='Per100k',
+                render_mode=render_mode,
                 color='Province',
                 hover_data=['Cases', 'Total'],
                 title='Provincial COVID-19 cases',
@@ -758,12 +868,73 @@ def on_data_set_table(data, active_tab):
 def render_tab_content(active_tab):
     if active_tab is not None:
         if active_tab == 'summary':
-            return summary_display, False
+            return summary_display(summary_stats.snapshot()), False
         elif active_tab == 'cases':
             return cases_display, True
         elif active_tab == 'testing':
             return testing_display, False
 
 
+@server.route('/prefetch-stats')
+def prefetch_stats():
+    return jsonify(dict(query_cache.stats(), **prefetcher.stats()))
+
+
+def export_arg_list(name):
+    values = []
+    for value in request.args.getlist(name):
+        values += [x.strip() for x in value.split(',') if x.strip()]
+    return values
+
+def export_arg_flag(name):
+    return request.args.get(name, '').lower() in ['1', 'true', 'y', 'yes']
+
+
+@server.route('/export/<dataset>.<fmt>')
+def export_data(dataset, fmt):
+    # Takes the same selection as the search panel, e.g.
+    # /export/cases.csv?regions=NCR,CAR&provinces=METRO MANILA&filters=Sex&summed=1
+    if dataset not in ['cases', 'deaths', 'aggs'] or fmt not in EXPORT_FORMATS:
+        abort(404)
+    if fmt == 'parquet' and pa is None:
+        abort(501, 'Parquet exports require pyarrow.')
+    filters = export_arg_list('filters')
+    if any(f not in EXPORT_FILTERS for f in filters):
+        abort(400, 'Filters must be among: ' + ', '.join(EXPORT_FILTERS))
+
+    national = export_arg_flag('national')
+    regions = export_arg_list('regions')
+    provinces = export_arg_list('provinces')
+    if not national:
+        if any(r not in provinces_by_region_dict for r in regions):
+            abort(400, 'Unknown region.')
+        if any(p not in region_by_province for p in provinces):
+            abort(400, 'Unknown province.')
+        # Mirror the dropdowns: regions alone select all of their provinces,
+        # and provinces alone select their own regions
+        if not provinces:
+            provinces = [p for r in regions for p in provinces_by_region_dict[r]]
+        elif not regions:
+            regions = sorted(set(region_by_province[p] for p in provinces))
+        elif any(region_by_province[p] not in regions for p in provinces):
+            abort(400, 'Provinces must be in the selected regions.')
+
+    key = query_key(
+        national,
+        [f for f in EXPORT_FILTERS if f in filters],
+        regions,
+        provinces,
+        export_arg_flag('summed')
+    )
+    data = query_cache.get(key)
+    return Response(
+        EXPORT_STREAMS[fmt](
+            data[dataset], data['columns'][dataset], data['dtypes'][dataset],
+            EXPORT_CHUNK_SIZE),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={dataset}.{fmt}'}
+    )
+
+
 if __name__ == '__main__':
     app.run_server(debug=True)
@@ -0,0 +1,69 @@
+"""Benchmark line chart rendering on synthetic province data.
+
+For each traces x days grid, reports px.line build time and the JSON payload
+size sent to the browser, for SVG and WebGL traces, with and without LTTB
+downsampling. Browser render time is not measured here, and that is where
+WebGL traces pay off. Run with: python benchmark_rendering.py
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import plotly.express as px
+
+from rendering import downsample_lines
+
+
+def synthetic_cases(n_traces, n_days, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-03-01', periods=n_days).strftime('%Y-%m-%d')
+    cases = rng.poisson(rng.uniform(0.5, 50, (n_traces, 1)), (n_traces, n_days)).astype(float)
+    return pd.DataFrame({
+        'Date': np.tile(dates, n_traces),
+        'Province': np.repeat([f'PROVINCE {i}' for i in range(n_traces)], n_days),
+        'Cases': cases.ravel(),
+        'Total': cases.cumsum(axis=1).ravel()
+    })
+
+
+def build_figure(df, render_mode):
+    start = time.perf_counter()
+    fig = px.line(
+        df,
+        x='Date',
+        y='Total',
+        color='Province',
+        hover_data=['Cases', 'Total'],
+        render_mode=render_mode,
+        template='plotly'
+    )
+    payload = fig.to_json()
+    return time.perf_counter() - start, len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--traces', type=int, nargs='+', default=[20, 80, 320])
+    parser.add_argument('--days', type=int, nargs='+', default=[120, 365])
+    parser.add_argument('--point-budget', type=int, default=20000)
+    parser.add_argument('--min-points', type=int, default=30)
+    args = parser.parse_args()
+
+    print(f"{'traces':>6} {'days':>5} {'mode':>6} {'lttb':>5} {'points':>8} "
+        f"{'build s':>8} {'payload KB':>11}")
+    for n_traces in args.traces:
+        for n_days in args.days:
+            df = synthetic_cases(n_traces, n_days)
+            threshold = max(args.point_budget // n_traces, args.min_points)
+            downsampled = downsample_lines(df, ['Province'], 'Total', threshold)
+            for render_mode in ['svg', 'webgl']:
+                for lttb, data in [('no', df), ('yes', downsampled)]:
+                    seconds, size = build_figure(data, render_mode)
+                    print(f'{n_traces:>6} {n_days:>5} {render_mode:>6} {lttb:>5} '
+                        f'{len(data):>8} {seconds:>8.3f} {size / 1024:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
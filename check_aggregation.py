@@ -0,0 +1,95 @@
+"""Check daily_cumulative_cases against the pandas pipeline it replaced.
+
+Runs both kernels (the NumPy bincount path and the loop path, jitted when
+numba is installed) on synthetic case data, for national and provincial
+selections and every breakdown filter. Records and column dtypes must match
+exactly; only the datetime unit of Date may differ between pandas versions.
+Run with: python check_aggregation.py
+"""
+import numpy as np
+import pandas as pd
+
+import aggregation
+from aggregation import _grouped_counts_loop, _grouped_counts_numpy, daily_cumulative_cases
+
+NATIONAL_POP = 100981437
+FILTERS = [[], ['AgeGroup'], ['Sex'], ['AgeGroup', 'Sex']]
+
+
+def pandas_pipeline(line_df, filters, all_checked):
+    # The cases time series code from filter_query() before the kernel
+    if all_checked:
+        cases_df = line_df.groupby(
+            ['DateRepConf', 'Country'] + filters
+        )['CaseCode'].count().reset_index(name='Cases')
+    else:
+        cases_df = line_df.groupby(
+            ['DateRepConf', 'Province', 'pop_2015'] + filters
+        )['CaseCode'].count().reset_index(name='Cases')
+
+    dates = cases_df['DateRepConf'].sort_values().values
+    datelist = pd.DataFrame(pd.date_range(start=dates[0], end=dates[-1], name='Date'))
+    cases_df = datelist.merge(cases_df, left_on='Date', right_on='DateRepConf', how='left')
+
+    cases_df['Cases'] = cases_df['Cases'].fillna(0)
+    if all_checked:
+        cases_df['Total'] = cases_df.groupby(['Country'] + filters)['Cases'].cumsum()
+        cases_df['Per100k'] = cases_df['Total'] / NATIONAL_POP * 100000
+        cases_df.drop(columns=['DateRepConf'], inplace=True)
+    else:
+        cases_df['Total'] = cases_df.groupby(['Province'] + filters)['Cases'].cumsum()
+        cases_df['Per100k'] = cases_df['Total'] / cases_df['pop_2015'] * 100000
+        cases_df.drop(columns=['DateRepConf', 'pop_2015'], inplace=True)
+    return cases_df.dropna()
+
+
+def synthetic_cases(n=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    provinces = [f'PROVINCE {i}' for i in range(40)]
+    populations = {p: int(rng.integers(100000, 10000000)) for p in provinces}
+    # A sparse early period leaves date gaps, as in the real data
+    days = np.where(rng.random(n) < 0.0005, rng.integers(0, 40, n), rng.integers(40, 140, n))
+    df = pd.DataFrame({
+        'CaseCode': [f'C{i}' for i in range(n)],
+        'DateRepConf': pd.Timestamp('2020-01-30') + pd.to_timedelta(days, 'D'),
+        'Province': rng.choice(provinces + [np.nan], n),
+        'AgeGroup': rng.choice(['0 to 4', '5 to 9', '80+', np.nan], n),
+        'Sex': rng.choice(['Male', 'Female'], n),
+        'Country': 'PHILIPPINES'
+    })
+    df.loc[rng.random(n) < 0.01, 'CaseCode'] = np.nan
+    df['pop_2015'] = df['Province'].map(populations)
+    return df
+
+
+def check(df, kernel_name):
+    for all_checked in [False, True]:
+        for filters in FILTERS:
+            expected = pandas_pipeline(df, filters, all_checked)
+            if all_checked:
+                actual = daily_cumulative_cases(df, ['Country'] + filters, NATIONAL_POP)
+            else:
+                actual = daily_cumulative_cases(
+                    df, ['Province', 'pop_2015'] + filters, 'pop_2015')
+            assert expected.to_dict('records') == actual.to_dict('records'), \
+                (kernel_name, all_checked, filters)
+            assert list(expected.dtypes)[1:] == list(actual.dtypes)[1:], \
+                (kernel_name, all_checked, filters)
+            print(f"{kernel_name:>6} national={all_checked!s:<5} filters={filters}: "
+                f"{len(actual)} rows, Cases {actual['Cases'].dtype}, ok")
+
+
+def main():
+    sparse = synthetic_cases()
+    # Every date present keeps Cases as integers
+    dense = sparse[sparse['DateRepConf'] >= '2020-03-10']
+    loop = aggregation.grouped_counts if aggregation.njit else _grouped_counts_loop
+    kernels = [('numpy', _grouped_counts_numpy), ('numba' if aggregation.njit else 'loop', loop)]
+    for kernel_name, kernel in kernels:
+        aggregation.grouped_counts = kernel
+        check(sparse, kernel_name)
+        check(dense, kernel_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+import math
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+def chunked(records, chunk_size):
+    for start in range(0, len(records), chunk_size):
+        yield records[start:start + chunk_size]
+
+def stream_csv(records, columns, dtypes, chunk_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for chunk in chunked(records, chunk_size):
+        for record in chunk:
+            writer.writerow([export_value(record[c]) for c in columns])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def stream_ndjson(records, columns, dtypes, chunk_size):
+    for chunk in chunked(records, chunk_size):
+        yield ''.join(
+            json.dumps({c: export_value(record[c]) for c in columns}) + '\n'
+            for record in chunk
+        )
+
+
+class _ParquetSink(io.RawIOBase):
+    # Hands written bytes back to the caller while keeping the file offset
+    # the Parquet footer needs
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def parquet_schema(columns, dtypes):
+    # Built from the source frame's dtypes, so it doesn't depend on which
+    # values happen to be in the first chunk; object columns hold strings
+    fields = []
+    for column, dtype in zip(columns, dtypes):
+        try:
+            numpy_dtype = np.dtype(dtype)
+        except TypeError:
+            numpy_dtype = None
+        if numpy_dtype is not None and numpy_dtype.kind in 'biufM':
+            fields.append(pa.field(column, pa.from_numpy_dtype(numpy_dtype)))
+        else:
+            fields.append(pa.field(column, pa.string()))
+    return pa.schema(fields)
+
+def stream_parquet(records, columns, dtypes, chunk_size):
+    # Each chunk becomes one row group; with no rows the file holds just the schema
+    if pa is None:
+        raise ImportError('pyarrow is required for Parquet exports')
+    schema = parquet_schema(columns, dtypes)
+    sink = _ParquetSink()
+    writer = pq.ParquetWriter(sink, schema)
+    for chunk in chunked(records, chunk_size):
+        df = pd.DataFrame.from_records(chunk, columns=columns)
+        writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+EXPORT_STREAMS = {
+    'csv': stream_csv,
+    'ndjson': stream_ndjson,
+    'parquet': stream_parquet
+}
@@ -0,0 +1,170 @@
+import logging
+import time
+from collections import OrderedDict, deque
+from threading import Condition, Event, Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCache:
+    """LRU cache of query results that can also be filled speculatively."""
+
+    def __init__(self, compute, maxsize=32, prefetch_limit=4):
+        self._compute = compute
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = Lock()
+        self.maxsize = maxsize
+        self.prefetch_limit = prefetch_limit
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.prefetch_hits = 0
+        self.prefetch_evicted = 0
+
+    def get(self, key):
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    return self._hit(key)
+                event = self._in_flight.get(key)
+                if event is None:
+                    self.misses += 1
+                    event = self._in_flight[key] = Event()
+                    break
+            # Another thread (usually the prefetcher) is computing this key
+            event.wait()
+        try:
+            data = self._compute(*key)
+            self._store(key, data, False)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            event.set()
+        return data
+
+    def prefetch(self, key):
+        with self._lock:
+            if key in self._entries or key in self._in_flight:
+                return
+            event = self._in_flight[key] = Event()
+        try:
+            data = self._compute(*key)
+            self._store(key, data, True)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            event.set()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries or key in self._in_flight
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'prefetched': self.prefetched,
+                'prefetch_hits': self.prefetch_hits,
+                'prefetch_hit_rate': (self.prefetch_hits / self.prefetched
+                    if self.prefetched else 0.0),
+                'prefetch_evicted': self.prefetch_evicted
+            }
+
+    def _hit(self, key):
+        data, speculative = self._entries[key]
+        self._entries[key] = (data, False)
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if speculative:
+            self.prefetch_hits += 1
+        return data
+
+    def _store(self, key, data, speculative):
+        with self._lock:
+            if speculative:
+                # Keep at most prefetch_limit unused speculative results,
+                # dropping the oldest so abandoned selections don't block new ones
+                unused = [k for k, (_, s) in self._entries.items() if s]
+                for old_key in unused[:max(len(unused) - self.prefetch_limit + 1, 0)]:
+                    del self._entries[old_key]
+                    self.prefetch_evicted += 1
+                self.prefetched += 1
+            self._entries[key] = (data, speculative)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                _, (_, evicted_speculative) = self._entries.popitem(last=False)
+                if evicted_speculative:
+                    self.prefetch_evicted += 1
+
+
+class Prefetcher:
+    """Background worker that fills a QueryCache with each session's latest selection.
+
+    Each session has at most one pending key, replaced by its newer submissions,
+    and at most max_pending sessions wait at once; the oldest is dropped first.
+    The worker computes at most max_per_minute prefetches in any rolling minute
+    and skips the rest, so speculation can't keep the process busy.
+    """
+
+    def __init__(self, cache, max_pending=16, max_per_minute=10):
+        self._cache = cache
+        self._pending = OrderedDict()
+        self._condition = Condition()
+        self._thread = None
+        self._started = deque()
+        self.max_pending = max_pending
+        self.max_per_minute = max_per_minute
+        self.dropped = 0
+        self.skipped = 0
+
+    def submit(self, session, key):
+        with self._condition:
+            self._pending.pop(session, None)
+            self._pending[session] = key
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+            if self._thread is None:
+                # Started lazily so each server worker process gets its own thread
+                self._thread = Thread(target=self._run, name='prefetch', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                _, key = self._pending.popitem(last=False)
+            if key in self._cache or not self._within_budget():
+                continue
+            try:
+                self._cache.prefetch(key)
+            except Exception:
+                logger.exception('Prefetch failed for %r', key)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._condition:
+            return {
+                'prefetch_dropped': self.dropped,
+                'prefetch_skipped': self.skipped,
+                'prefetch_budget_per_minute': self.max_per_minute,
+                'prefetch_budget_used': sum(1 for t in self._started if now - t < 60)
+            }
+
+    def _within_budget(self):
+        now = time.monotonic()
+        with self._condition:
+            while self._started and now - self._started[0] >= 60:
+                self._started.popleft()
+            if len(self._started) >= self.max_per_minute:
+                self.skipped += 1
+                return False
+            self._started.append(now)
+            return True
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+
+def lttb_indices(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the points that best preserve the line's shape
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    indices = [0]
+    for i in range(threshold - 2):
+        avg_start = int(np.floor((i + 1) * every)) + 1
+        avg_end = min(int(np.floor((i + 2) * every)) + 1, n)
+        avg_x = x[avg_start:avg_end].mean()
+        avg_y = y[avg_start:avg_end].mean()
+
+        range_start = int(np.floor(i * every)) + 1
+        range_end = int(np.floor((i + 1) * every)) + 1
+        areas = np.abs(
+            (x[a] - avg_x) * (y[range_start:range_end] - y[a])
+            - (x[a] - x[range_start:range_end]) * (avg_y - y[a])
+        )
+        a = range_start + int(areas.argmax())
+        indices.append(a)
+    indices.append(n - 1)
+    return np.array(indices)
+
+
+def downsample_lines(df, keys, y, threshold):
+    if threshold < 3:
+        return df
+    df = df.sort_values('Date')
+    x_values = pd.to_datetime(df['Date']).values.astype('int64').astype(float)
+    y_values = df[y].values.astype(float)
+    keep = []
+    for positions in df.groupby(keys, sort=False).indices.values():
+        selected = lttb_indices(x_values[positions], y_values[positions], threshold)
+        keep.append(positions[selected])
+    return df.iloc[np.sort(np.concatenate(keep))]
+
+
+def collapse_provinces(df, keys, keep, populations):
+    # Sum every province outside the top `keep` (by total cases) into one trace
+    totals = df.groupby('Province')['Cases'].sum().sort_values(ascending=False)
+    if keep < 1 or len(totals) <= keep + 1:
+        return df
+    others = totals.index[keep:]
+    other_df = df[df['Province'].isin(others)]
+    other_keys = [k for k in keys if k != 'Province']
+    other_df = other_df.groupby(['Date'] + other_keys)['Cases'].sum().reset_index()
+    other_df = other_df.sort_values('Date')
+    if other_keys:
+        other_df['Total'] = other_df.groupby(other_keys)['Cases'].cumsum()
+    else:
+        other_df['Total'] = other_df['Cases'].cumsum()
+    other_pop = sum(populations.get(province, 0) for province in others)
+    other_df['Per100k'] = other_df['Total'] / other_pop * 100000 if other_pop else np.nan
+    other_df['Province'] = 'OTHER PROVINCES'
+    return pd.concat([df[~df['Province'].isin(others)], other_df], ignore_index=True)
@@ -0,0 +1,92 @@
+from collections import Counter
+from threading import Lock
+
+import pandas as pd
+
+
+def _add_counts(counter, counts, sign=1):
+    for key, count in counts.items():
+        counter[key] += sign * int(count)
+
+
+class SummaryStats:
+    """National case and testing counters, updated incrementally as data arrives.
+
+    Totals are running sums, and per-date counts give the deltas for the latest
+    reported day. Each update only scans the rows passed in. Deaths and
+    recoveries are dated by `removal_date_column`, which should hold the date the
+    removal was reported rather than the date of death or recovery.
+
+    The app loads the data drop once at import, so add_cases() and add_tests()
+    are only called there; update_status() and later add_* calls are the API
+    for a future data refresh.
+    """
+
+    def __init__(self, removal_date_column='DateRepRem'):
+        self.removal_date_column = removal_date_column
+        self.cases = 0
+        self.deaths = 0
+        self.recoveries = 0
+        self.tests = 0
+        self._cases_by_date = Counter()
+        self._deaths_by_date = Counter()
+        self._recoveries_by_date = Counter()
+        self._tests_by_date = Counter()
+        self._facility_tests = {}
+        self._lock = Lock()
+
+    def add_cases(self, new_rows):
+        # Rows for cases not seen before
+        new_rows = new_rows[new_rows['CaseCode'].notna()]
+        with self._lock:
+            self.cases += len(new_rows)
+            _add_counts(self._cases_by_date, new_rows['DateRepConf'].value_counts())
+            self._add_removals(new_rows, 1)
+
+    def update_status(self, old_rows, new_rows):
+        # Existing cases whose rows changed, e.g. when a case is later reported recovered
+        old_rows = old_rows[old_rows['CaseCode'].notna()]
+        new_rows = new_rows[new_rows['CaseCode'].notna()]
+        with self._lock:
+            self._add_removals(old_rows, -1)
+            self._add_removals(new_rows, 1)
+
+    def add_tests(self, new_rows):
+        # Each facility reports a cumulative count, so keep its running max
+        latest = new_rows.groupby('facility_name')['cumulative_unique_individuals'].max()
+        daily = new_rows.groupby(
+            pd.to_datetime(new_rows['report_date'])
+        )['daily_output_unique_individuals'].sum()
+        with self._lock:
+            for facility, count in latest.items():
+                previous = self._facility_tests.get(facility, 0)
+                if count > previous:
+                    self._facility_tests[facility] = count
+                    self.tests += int(count - previous)
+            _add_counts(self._tests_by_date, daily)
+
+    def snapshot(self):
+        with self._lock:
+            cases_date = max(self._cases_by_date) if self._cases_by_date else None
+            tests_date = max(self._tests_by_date) if self._tests_by_date else None
+            return {
+                'cases': self.cases,
+                'deaths': self.deaths,
+                'recoveries': self.recoveries,
+                'tests': self.tests,
+                'cases_date': cases_date,
+                'new_cases': self._cases_by_date[cases_date],
+                'new_deaths': self._deaths_by_date[cases_date],
+                'new_recoveries': self._recoveries_by_date[cases_date],
+                'tests_date': tests_date,
+                'new_tests': self._tests_by_date[tests_date]
+            }
+
+    def _add_removals(self, rows, sign):
+        died = rows[rows['HealthStatus'] == 'Died']
+        recovered = rows[rows['HealthStatus'] == 'Recovered']
+        self.deaths += sign * len(died)
+        self.recoveries += sign * len(recovered)
+        _add_counts(self._deaths_by_date, died[self.removal_date_column].value_counts(), sign)
+        _add_counts(
+            self._recoveries_by_date, recovered[self.removal_date_column].value_counts(), sign)